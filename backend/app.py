@@ -1,5 +1,6 @@
 import os
 import json
+import importlib.util
 import tempfile
 import requests
 from flask import Flask, request, jsonify
@@ -9,6 +10,13 @@ from supabase import create_client, Client
 from PIL import Image
 import numpy as np
 
+def module_available(name: str) -> bool:
+    """True if `name` is installed, without importing it (only its parent packages)."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
 # Import updated processing modules
 try:
     from bg_remove import ImageProcessor
@@ -19,7 +27,10 @@ except ImportError:
 
 try:
     from json_from_clean import get_tags_with_retry, process_image_batch, init_gemini, init_fashion_clip
-    has_json_processor = True
+    # json_from_clean imports Gemini and FashionCLIP lazily, so check they're installed here
+    has_json_processor = module_available("google.generativeai") and module_available("fashion_clip")
+    if not has_json_processor:
+        print("⚠️ google-generativeai / fashion_clip not installed; tagging disabled")
 except ImportError:
     has_json_processor = False
     print("⚠️ json_from_clean module not available")
@@ -61,6 +72,10 @@ if has_json_processor:
     try:
         gemini_model = init_gemini()
         fashion_clip = init_fashion_clip()
+        # get_tags_with_retry / process_image_batch read json_from_clean's module globals
+        import json_from_clean
+        json_from_clean.model = gemini_model
+        json_from_clean.fclip = fashion_clip
     except Exception as e:
         print(f"⚠️ Failed to initialize AI models: {e}")
 
@@ -200,10 +215,11 @@ def process_clothing():
             embedding = []
             if has_json_processor and fashion_clip:
                 try:
-                    from pathlib import Path
-                    embeddings = process_image_batch([Path(clean_image_path)], fashion_clip)
-                    if embeddings and len(embeddings) > 0:
-                        embedding = embeddings[0]
+                    # Same input the batch pipeline uses: a decoded RGB PIL image
+                    embeddings = process_image_batch([clean_pil_for_analysis.convert('RGB')])
+                    if len(embeddings) > 0:
+                        # float16 row -> plain floats for the Supabase JSON column
+                        embedding = embeddings[0].tolist()
                         print(f"✅ Generated {len(embedding)}-dim embedding")
                 except Exception as e:
                     print(f"⚠️ Embedding generation failed: {e}")
@@ -7,7 +7,9 @@ import logging
 
 import cv2
 import numpy as np
-from rembg import remove, new_session
+import onnxruntime as ort
+from rembg import remove
+from rembg.sessions.u2net_human_seg import U2netHumanSegSession
 from PIL import Image, ImageOps
 
 # Optional: AVIF support (install with: pip install pillow-avif)
@@ -34,13 +36,37 @@ logger = logging.getLogger(__name__)
 # Global session to prevent reloading model 4x times
 _SESSION = None
 
+def get_session_options() -> ort.SessionOptions:
+    """
+    ONNX Runtime options for the shared session: full graph optimization and
+    an intra-op pool sized to all cores. The pool belongs to the session, so
+    every worker's run draws from it. Spinning is disabled so idle pool
+    threads don't busy-wait.
+    """
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    so.intra_op_num_threads = os.cpu_count() or 1
+    so.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return so
+
 def get_session():
     global _SESSION
     if _SESSION is None:
         logger.info("⏳ Loading AI Model (u2net_human_seg)...")
-        _SESSION = new_session("u2net_human_seg")
+        # rembg's new_session() builds its own SessionOptions, so construct the
+        # session class directly to pass ours in.
+        _SESSION = U2netHumanSegSession(
+            "u2net_human_seg",
+            get_session_options(),
+            providers=ort.get_available_providers(),
+        )
     return _SESSION
 
+def resize_interpolation(scale: float) -> int:
+    """INTER_AREA when shrinking (LANCZOS4 aliases on big downscales), LANCZOS4 when enlarging."""
+    return cv2.INTER_AREA if scale < 1 else cv2.INTER_LANCZOS4
+
 class ImageProcessor:
     def __init__(self):
         # Kernels for morphological operations
@@ -81,55 +107,73 @@ class ImageProcessor:
         contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         if not contours: return img_array
 
-        # Sort contours by area
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)
-        largest_cnt = contours[0]
+        # Compute each area once and pick the top 2 without a full sort
+        areas = np.fromiter((cv2.contourArea(c) for c in contours), dtype=np.float32, count=len(contours))
+        if len(areas) > 2:
+            top2 = np.argpartition(-areas, 1)[:2]
+            top2 = top2[np.argsort(-areas[top2])]
+        else:
+            top2 = np.argsort(-areas)
+        largest_idx = top2[0]
         
         # Create a fresh mask with ONLY the largest object
         new_mask = np.zeros_like(alpha)
-        cv2.drawContours(new_mask, [largest_cnt], -1, 255, thickness=cv2.FILLED)
+        cv2.drawContours(new_mask, [contours[largest_idx]], -1, 255, thickness=cv2.FILLED)
         
         # Also keep 2nd largest if it's significant (e.g. a detached belt or shoe)
-        if len(contours) > 1:
-            second_cnt = contours[1]
-            if cv2.contourArea(second_cnt) > (cv2.contourArea(largest_cnt) * 0.1):
-                 cv2.drawContours(new_mask, [second_cnt], -1, 255, thickness=cv2.FILLED)
+        if len(top2) > 1:
+            second_idx = top2[1]
+            if areas[second_idx] > (areas[largest_idx] * 0.1):
+                 cv2.drawContours(new_mask, [contours[second_idx]], -1, 255, thickness=cv2.FILLED)
 
         img_array[:, :, 3] = new_mask
         return img_array
 
-    def center_on_canvas(self, pil_img: Image.Image, output_size: int) -> Image.Image:
+    def center_on_canvas_np(self, img_array: np.ndarray, output_size: int) -> np.ndarray:
         """
-        Locates the garment, crops it tight, and centers it on the square canvas.
-        Essential for Vector Embedding accuracy.
+        Numpy variant of center_on_canvas: crops, resizes and centers the
+        RGBA array directly so the pipeline never round-trips through PIL.
         """
-        img_array = np.array(pil_img)
         alpha = img_array[:, :, 3]
         
         # Find Bounding Box of the actual pixels
         coords = cv2.findNonZero(alpha)
-        if coords is None: return pil_img.resize((output_size, output_size))
+        if coords is None:
+            scale = output_size / max(img_array.shape[:2])
+            return cv2.resize(img_array, (output_size, output_size), interpolation=resize_interpolation(scale))
         
         x, y, w, h = cv2.boundingRect(coords)
         
-        # Crop tight to the object
-        crop = pil_img.crop((x, y, x+w, y+h))
+        # Crop tight to the object (a view, no copy)
+        crop = img_array[y:y+h, x:x+w]
         
         # Calculate resize factor (Fit to 90% of canvas)
         target_dim = int(output_size * 0.90)
         max_dim = max(w, h)
         scale = target_dim / max_dim
         
-        new_w, new_h = int(w * scale), int(h * scale)
-        crop_resized = crop.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
+        crop_resized = cv2.resize(crop, (new_w, new_h), interpolation=resize_interpolation(scale))
+        
+        # Place into center of a transparent canvas. Same result as PIL's
+        # paste(im, box, mask=im) onto (0,0,0,0): every channel, alpha included,
+        # is weighted by alpha with PIL's rounded divide-by-255.
+        a = crop_resized[:, :, 3:4].astype(np.uint16)
+        tmp = crop_resized.astype(np.uint16) * a + 128
+        blended = (((tmp >> 8) + tmp) >> 8).astype(np.uint8)
         
-        # Paste into center
-        final_img = Image.new('RGBA', (output_size, output_size), (0, 0, 0, 0))
+        final_arr = np.zeros((output_size, output_size, 4), dtype=np.uint8)
         paste_x = (output_size - new_w) // 2
         paste_y = (output_size - new_h) // 2
-        
-        final_img.paste(crop_resized, (paste_x, paste_y), crop_resized)
-        return final_img
+        final_arr[paste_y:paste_y+new_h, paste_x:paste_x+new_w] = blended
+        return final_arr
+
+    def center_on_canvas(self, pil_img: Image.Image, output_size: int) -> Image.Image:
+        """
+        Locates the garment, crops it tight, and centers it on the square canvas.
+        Essential for Vector Embedding accuracy.
+        """
+        return Image.fromarray(self.center_on_canvas_np(np.array(pil_img.convert("RGBA")), output_size))
 
     def process_image(self, image_path: Path) -> Optional[Image.Image]:
         try:
@@ -150,11 +194,10 @@ class ImageProcessor:
             # 3. Polish: Remove Halo & Smooth Edges
             img_array = self.remove_halo_and_smooth(img_array)
             
-            # 4. Format: Center & Resize
-            result_img = Image.fromarray(img_array)
-            final_img = self.center_on_canvas(result_img, OUTPUT_SIZE)
+            # 4. Format: Center & Resize (stays in numpy, single PIL conversion at the end)
+            final_arr = self.center_on_canvas_np(img_array, OUTPUT_SIZE)
             
-            return final_img
+            return Image.fromarray(final_arr)
             
         except Exception as e:
             logger.error(f"❌ Error on {image_path.name}: {e}")
@@ -165,8 +208,9 @@ def worker(args):
     path, proc, out_dir = args
     res = proc.process_image(path)
     if res:
-        # Save as PNG to preserve transparency
-        res.save(out_dir / f"{path.stem}_clean.png", "PNG")
+        # Save as PNG to preserve transparency. Fast zlib level: these are
+        # intermediate assets that Cloudinary re-encodes on upload anyway.
+        res.save(out_dir / f"{path.stem}_clean.png", "PNG", optimize=False, compress_level=1)
         return True
     return False
 
@@ -11,6 +11,7 @@ import time
 from pathlib import Path
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from store import load_embeddings
 
 # Load environment variables
 load_dotenv()
@@ -143,7 +144,7 @@ def upload_to_cloudinary(image_path, folder):
         else:
             raise Exception(f"Cloudinary upload failed: {response.text}")
 
-def migrate_item(json_path):
+def migrate_item(json_path, sidecar=None):
     """Migrate a single wardrobe item to database"""
     try:
         # Load JSON metadata
@@ -153,6 +154,11 @@ def migrate_item(json_path):
         meta = item_data.get('meta', {})
         embedding = item_data.get('embedding', [])
         
+        # Newer records keep their vector in the shared _embeddings.npy sidecar
+        item_id = item_data.get('id')
+        if not embedding and sidecar and item_id in sidecar:
+            embedding = sidecar[item_id].astype(float).tolist()
+        
         # Find corresponding image file
         image_filename = json_path.stem + '_clean.png'
         clean_image_path = IMAGES_DIR / image_filename
@@ -213,8 +219,8 @@ def import_all_items():
     print("\n📥 Starting import...")
     print("=" * 50)
     
-    # Get all JSON files
-    json_files = sorted(JSON_DIR.glob("*.json"))
+    # Get all JSON files ("_" files are summaries / sidecars, not items)
+    json_files = sorted(p for p in JSON_DIR.glob("*.json") if not p.name.startswith("_"))
     
     if not json_files:
         print(f"⚠️ No JSON files found in {JSON_DIR}")
@@ -222,11 +228,13 @@ def import_all_items():
     
     print(f"📦 Found {len(json_files)} items to import\n")
     
+    sidecar = load_embeddings(str(JSON_DIR))
+    
     success_count = 0
     fail_count = 0
     
     for json_path in json_files:
-        if migrate_item(json_path):
+        if migrate_item(json_path, sidecar):
             success_count += 1
         else:
             fail_count += 1
@@ -1,21 +1,32 @@
+import io
 import os
+import atexit
+import signal
+import re
+import random
 import json
+import orjson
 import time
 import sys
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 import concurrent.futures
+import contextlib
+from collections import Counter, deque, namedtuple
+import numpy as np
 from PIL import Image
-import google.generativeai as genai
-from fashion_clip.fashion_clip import FashionCLIP
 from tqdm import tqdm
 import hashlib
+import mmap
+import xxhash
 import logging
 from dataclasses import dataclass, asdict
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from threading import Lock
-import google.api_core.exceptions
+from functools import lru_cache
+from tenacity import retry, wait_exponential, wait_random, retry_if_exception
+from threading import Condition, Lock
 from dotenv import load_dotenv
+from store import EMBEDDINGS_FILE, EMBEDDINGS_INDEX_FILE, load_embeddings
+from models import get_fashion_clip
 
 # Load environment variables
 load_dotenv()
@@ -42,9 +53,18 @@ JSON_OUTPUT_DIR = Path("Ideal Wardrobe/data/json")
 GEMINI_MODEL = "gemini-2.5-flash"
 REQUESTS_PER_MINUTE = 10
 
-MAX_WORKERS = 3  # Optimal for 10 RPM
-BATCH_SIZE = 16
-RATE_LIMIT_DELAY = 6.5  # Seconds between requests (60s / 10 requests = 6s, +0.5s buffer)
+MAX_WORKERS = 3  # Starting Gemini concurrency; adapts between 1 and MAX_CONCURRENCY
+MAX_CONCURRENCY = max(1, REQUESTS_PER_MINUTE // 2)
+CIRCUIT_BREAK_AFTER = 3  # Consecutive 429s before pausing all Gemini calls
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 4)  # Threads for the I/O-bound change-detection and image-loading passes
+BATCH_SIZE = 64  # FashionCLIP DataLoader batch for the single encode_images call
+PRETTY_JSON = False  # Indent per-item records (debugging only; set by --pretty)
+HASH_CHUNK_SIZE = 64 << 20  # Feed mmapped images to the hasher in 64 MiB views
+RATE_LIMIT_WINDOW = 60.0  # Seconds; at most REQUESTS_PER_MINUTE calls per rolling window
+MAX_RETRY_AFTER = 45.0  # Cap on a server-suggested retry delay (seconds)
+TAG_BATCH_SIZE = 4  # Images per Gemini request; RPM budget then covers 4x the items
+GEMINI_MAX_EDGE = 1024  # Downscale longest edge before upload; plenty for tagging
+GEMINI_JPEG_QUALITY = 85
 
 # Setup logging with UTF-8 encoding
 logging.basicConfig(
@@ -84,14 +104,28 @@ class WardrobeItem:
     id: str
     timestamp: float
     image_hash: str
+    file_size: int
+    mtime_ns: int
     meta: ClothingMetadata
-    embedding: List[float]
-    paths: Dict[str, str]
+    paths: Dict[str, str]  # embedding lives in the shared EMBEDDINGS_FILE matrix
     processing_version: str = "2.0"
+    hash_algo: str = "xxh3_128"  # records without this field used md5
+
+# Paths for one image, derived once at discovery
+FileJob = namedtuple("FileJob", "abs_path base_name json_path")
+
+def make_job(abs_path: Path) -> FileJob:
+    """abs_path must already be absolute (main lists a resolved directory)."""
+    base_name = abs_path.stem.replace("_clean", "")
+    return FileJob(abs_path, base_name, JSON_OUTPUT_DIR / f"{base_name}.json")
 
 # --- INITIALIZATION ---
+# google.generativeai and FashionCLIP (torch) are imported inside the init
+# functions so importing this module for its helpers stays cheap.
 def init_gemini():
     """Initialize Gemini with error handling."""
+    import google.generativeai as genai
+    
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY must be set!")
     
@@ -106,53 +140,200 @@ def init_gemini():
     
     logger.info(f"Using model: {GEMINI_MODEL} (Rate limit: {REQUESTS_PER_MINUTE} RPM)")
     
+    # The schema is sent once as the system instruction, not with every image
     return genai.GenerativeModel(
         GEMINI_MODEL,
-        generation_config=generation_config
+        generation_config=generation_config,
+        system_instruction=TAGGING_PROMPT
     )
 
 def init_fashion_clip():
-    """Initialize FashionCLIP with logging."""
+    """Initialize FashionCLIP with logging (shared with the planner via models.py)."""
     logger.info("Loading FashionCLIP model...")
-    return FashionCLIP('fashion-clip')
+    return get_fashion_clip()
 
 # Global instances
 model = None
 fclip = None
-api_lock = Lock()  # Thread-safe API access
-last_api_call_time = 0
-
-def get_image_hash(image_path: Path) -> str:
-    """Generate hash of image for change detection."""
-    with open(image_path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
-
-def rate_limited_api_call():
-    """Enforce rate limiting between API calls."""
-    global last_api_call_time
-    
-    with api_lock:
-        current_time = time.time()
-        time_since_last_call = current_time - last_api_call_time
-        
-        if time_since_last_call < RATE_LIMIT_DELAY:
-            sleep_time = RATE_LIMIT_DELAY - time_since_last_call
+embedded_ids = set()  # Item ids present in the embeddings sidecar
+
+def get_image_fingerprint(image_path: Path) -> tuple:
+    """Cheap (size, mtime_ns) stat fingerprint used before hashing."""
+    st = os.stat(image_path)
+    return st.st_size, st.st_mtime_ns
+
+@lru_cache(maxsize=4096)
+def _hash_file(path_str: str, size: int, mtime_ns: int, algo: str) -> str:
+    # size/mtime_ns are only part of the cache key, so an edited file is re-read
+    hasher = xxhash.xxh3_128() if algo == "xxh3_128" else hashlib.md5()
+    if size == 0:  # mmap can't map an empty file
+        return hasher.hexdigest()
+    # Hash straight from the page cache; no Python bytes copy of the file
+    with open(path_str, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            for start in range(0, len(view), HASH_CHUNK_SIZE):
+                hasher.update(view[start:start + HASH_CHUNK_SIZE])
+    return hasher.hexdigest()
+
+def get_image_hash(image_path: Path, algo: str = "xxh3_128") -> str:
+    """Generate hash of image for change detection (md5 only for older records)."""
+    size, mtime_ns = get_image_fingerprint(image_path)
+    return _hash_file(str(image_path), size, mtime_ns, algo)
+
+class SlidingWindowLimiter:
+    """
+    Thread-safe limiter allowing at most `rpm` calls in any rolling window.
+    Unlike a fixed gap between calls, workers can use the full budget and
+    burst into slack left by slower stages.
+    """
+    def __init__(self, rpm: int, window: float = RATE_LIMIT_WINDOW):
+        self.rpm = rpm
+        self.window = window
+        self.calls = deque()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.window:
+                    self.calls.popleft()
+                
+                if len(self.calls) < self.rpm:
+                    self.calls.append(now)
+                    return
+                sleep_time = self.calls[0] + self.window - now
+            
+            # Sleep outside the lock so other workers can still check for a free slot
             logger.debug(f"Rate limiting: sleeping {sleep_time:.1f}s")
             time.sleep(sleep_time)
-        
-        last_api_call_time = time.time()
 
-@retry(
-    stop=stop_after_attempt(5),  # Increased attempts
-    wait=wait_exponential(multiplier=2, min=4, max=60),  # Longer backoff
-    retry=retry_if_exception_type((Exception,)),
-    reraise=True
-)
-def get_tags_with_retry(pil_image: Image.Image) -> Dict:
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+class AdaptiveConcurrency:
     """
-    Enhanced tagging with retry logic and comprehensive schema.
+    AIMD limit on in-flight Gemini calls: +0.5 per healthy response, halved
+    on a 429. After CIRCUIT_BREAK_AFTER consecutive 429s the breaker opens
+    and every caller waits min(60 * 2^k, 600)s before trying again.
+    """
+    def __init__(self, initial: int, maximum: int):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self.consecutive_throttles = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.cond = Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                pause = self.open_until - time.monotonic()
+                if pause > 0:
+                    self.cond.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit * 0.5)
+                self.consecutive_throttles += 1
+                if self.consecutive_throttles >= CIRCUIT_BREAK_AFTER:
+                    pause = min(60 * 2 ** self.trips, 600)
+                    logger.warning(f"Circuit open: {self.consecutive_throttles} consecutive 429s, pausing Gemini calls for {pause}s")
+                    self.open_until = time.monotonic() + pause
+                    self.trips += 1
+                    self.consecutive_throttles = 0
+            else:
+                self.limit = min(float(self.maximum), self.limit + 0.5)
+                self.consecutive_throttles = 0
+                self.trips = 0
+            self.cond.notify_all()
+
+rate_limiter = SlidingWindowLimiter(REQUESTS_PER_MINUTE)
+gemini_concurrency = AdaptiveConcurrency(MAX_WORKERS, MAX_CONCURRENCY)
+
+RETRY_AFTER_RE = re.compile(r"retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+# Jitter keeps workers that were throttled together from retrying in lockstep
+_default_backoff = wait_exponential(multiplier=2, min=4, max=60) + wait_random(0, 1)
+
+def parse_retry_after(exc: Exception) -> Optional[float]:
+    """Extract the server's suggested retry delay from a 429, if it sent one."""
+    # gRPC errors carry google.rpc.RetryInfo in .details
+    for detail in getattr(exc, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    
+    # REST errors only mention it in the message
+    match = RETRY_AFTER_RE.search(str(exc))
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
+
+def gemini_retry_wait(retry_state) -> float:
+    """
+    Malformed responses (bad JSON / missing fields) retry immediately,
+    429s wait as long as the server asks, everything else backs off.
     """
-    prompt = """
+    import google.api_core.exceptions
+    
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, ValueError):  # includes json.JSONDecodeError
+        return 0.0
+    if isinstance(exc, google.api_core.exceptions.ResourceExhausted):
+        delay = parse_retry_after(exc)
+        if delay is not None:
+            return min(delay, MAX_RETRY_AFTER) + random.uniform(0, 1)
+    return _default_backoff(retry_state)
+
+def is_retryable(exc: BaseException) -> bool:
+    """Malformed responses and transient API/network errors; not auth, bad requests or bugs."""
+    import google.api_core.exceptions as gexc
+    
+    return isinstance(exc, (
+        ValueError,  # includes json.JSONDecodeError
+        ConnectionError,
+        TimeoutError,
+        gexc.ResourceExhausted,
+        gexc.TooManyRequests,
+        gexc.ServiceUnavailable,
+        gexc.DeadlineExceeded,
+        gexc.InternalServerError,
+    ))
+
+def gemini_retry_stop(retry_state) -> bool:
+    """Validation failures get 2 retries, API errors 4."""
+    if isinstance(retry_state.outcome.exception(), ValueError):
+        return retry_state.attempt_number >= 3
+    return retry_state.attempt_number >= 5
+
+# Fields save_item indexes directly; each must be a string
+REQUIRED_TAG_FIELDS = ('category', 'sub_category', 'primary_color', 'pattern', 'seasonality', 'formality')
+
+def prepare_for_gemini(pil_image: Union[Image.Image, Dict]) -> Dict:
+    """Downscale to GEMINI_MAX_EDGE and JPEG-encode, instead of the SDK's full-size PNG."""
+    if isinstance(pil_image, dict):
+        return pil_image
+    img = pil_image if pil_image.mode == 'RGB' else pil_image.convert('RGB')
+    longest = max(img.size)
+    if longest > GEMINI_MAX_EDGE:
+        # resize() returns a copy, so the shared image the embedding thread reads is untouched
+        scale = GEMINI_MAX_EDGE / longest
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=GEMINI_JPEG_QUALITY)
+    return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
+
+TAGGING_PROMPT = """
 You are a professional fashion analyst AI. Analyze this clothing item with precision.
 
 Return ONLY a JSON object (no markdown, no explanation) using this EXACT schema:
@@ -180,45 +361,114 @@ CRITICAL RULES:
 5. Be specific with sub_category (not just "shirt" but "Oxford Shirt", "Graphic Tee", etc.)
 6. Consider the actual use case, not just appearance for formality/occasion
 """
+
+# Per-request user text; the schema itself is the model's system instruction
+ITEM_USER_PROMPT = "Analyze this clothing item."
+BATCH_USER_PROMPT = """
+You will receive {n} images. Return ONLY a JSON array of exactly {n} objects,
+one per image and in the same order as the images, each using the schema above.
+"""
+
+def validate_tags(parsed) -> Dict:
+    """Check shape and required string fields (ValueError retries immediately)."""
+    if not isinstance(parsed, dict) or not all(isinstance(parsed.get(field), str) for field in REQUIRED_TAG_FIELDS):
+        raise ValueError(f"Missing required fields in response: {parsed}")
+    return parsed
+
+@retry(
+    stop=gemini_retry_stop,
+    wait=gemini_retry_wait,
+    retry=retry_if_exception(is_retryable),
+    reraise=True
+)
+def request_tags(parts: list, count: Optional[int] = None):
+    """
+    One Gemini call with retry logic. With count=None expects a single tag
+    object; otherwise a JSON array of exactly `count` objects.
+    """
+    import google.api_core.exceptions
     
     try:
-        # Rate limit before making API call
-        rate_limited_api_call()
-        
-        response = model.generate_content([prompt, pil_image])
-        parsed = json.loads(response.text)
-        
-        # Validate required fields
-        required_fields = ['category', 'sub_category', 'primary_color', 'pattern', 'seasonality', 'formality']
-        if not all(field in parsed for field in required_fields):
-            raise ValueError(f"Missing required fields in response: {parsed}")
+        # Take an adaptive concurrency slot, then rate limit before the API call
+        gemini_concurrency.acquire()
+        throttled = False
+        try:
+            rate_limiter.acquire()
+            response = model.generate_content(parts)
+        except google.api_core.exceptions.ResourceExhausted:
+            throttled = True
+            raise
+        finally:
+            gemini_concurrency.release(throttled)
+        parsed = orjson.loads(response.text)
         
-        return parsed
+        if count is None:
+            return validate_tags(parsed)
+        if not isinstance(parsed, list) or len(parsed) != count:
+            raise ValueError(f"Expected a list of {count} tag objects, got: {str(parsed)[:200]}")
+        return [validate_tags(tags) for tags in parsed]
         
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing failed: {e}")
         logger.error(f"Raw response: {response.text[:200]}")
         raise
     except google.api_core.exceptions.ResourceExhausted as e:
-        logger.warning(f"Rate limit hit, will retry with backoff: {e}")
+        logger.warning(f"Rate limit hit, will retry after the server's delay: {e}")
         raise
     except Exception as e:
         logger.error(f"Tagging error: {e}")
         raise
 
-def process_image_batch(image_paths: List[Path]) -> List[List[float]]:
+def get_tags_with_retry(pil_image: Union[Image.Image, Dict]) -> Dict:
+    """
+    Enhanced tagging with retry logic and comprehensive schema.
+    Accepts a PIL image or a blob already built by prepare_for_gemini.
+    """
+    return request_tags([ITEM_USER_PROMPT, prepare_for_gemini(pil_image)])
+
+def get_tags_batch_with_retry(images: List[Union[Image.Image, Dict]]) -> List[Dict]:
+    """Tag several images in one request; results are in input order."""
+    blobs = [prepare_for_gemini(img) for img in images]
+    return request_tags([BATCH_USER_PROMPT.format(n=len(blobs)), *blobs], count=len(blobs))
+
+# One read of an image file: decoded pixels plus the hash/fingerprint for its record
+DecodedImage = namedtuple("DecodedImage", "pil_rgb hash_hex fingerprint")
+
+def load_image(image_path: Path) -> DecodedImage:
+    """Read an image once, hash the bytes and decode them to RGB."""
+    with open(image_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        pil_rgb = img.convert('RGB')
+    return DecodedImage(pil_rgb, xxhash.xxh3_128_hexdigest(data), (st.st_size, st.st_mtime_ns))
+
+def fclip_inference_context() -> contextlib.ExitStack:
+    """No autograd bookkeeping; on CUDA also run the image tower in fp16 autocast."""
+    import torch
+    
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if str(getattr(fclip, 'device', 'cpu')).startswith('cuda'):
+        stack.enter_context(torch.autocast('cuda', dtype=torch.float16))
+    return stack
+
+def process_image_batch(images: List[Union[Path, Image.Image]]) -> np.ndarray:
     """
     Process multiple images through FashionCLIP in a single batch.
+    Accepts paths or already-decoded PIL images (which skip a second decode).
+    Returns an (n, dim) float16 array, one row per image.
     """
     try:
-        # Convert Path objects to strings, ensure they're absolute paths
-        str_paths = [str(p.resolve()) for p in image_paths]
+        # Paths are passed through as-is; callers hand in absolute paths
+        inputs = [img if isinstance(img, Image.Image) else os.fspath(img) for img in images]
         
-        embeddings = fclip.encode_images(
-            str_paths,
-            batch_size=BATCH_SIZE
-        )
-        return [emb.tolist() for emb in embeddings]
+        with fclip_inference_context():
+            embeddings = fclip.encode_images(
+                inputs,
+                batch_size=BATCH_SIZE
+            )
+        return np.asarray(embeddings).astype(np.float16)
     except Exception as e:
         logger.error(f"Batch embedding failed: {e}")
         raise
@@ -229,161 +479,254 @@ def needs_reprocessing(json_path: Path, image_path: Path) -> bool:
         return True
     
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
+        with open(json_path, 'rb') as f:
+            existing = orjson.loads(f.read())
         
         # Check version
         if existing.get('processing_version') != '2.0':
             return True
         
+        # Check embedding (sidecar matrix, or inline in pre-sidecar records)
+        if json_path.stem not in embedded_ids and not existing.get('embedding'):
+            return True
+        
+        # Unchanged size + mtime: skip reading the image at all
+        size, mtime_ns = get_image_fingerprint(image_path)
+        if existing.get('file_size') == size and existing.get('mtime_ns') == mtime_ns:
+            return False
+        
         # Check image hash
-        current_hash = get_image_hash(image_path)
+        current_hash = get_image_hash(image_path, existing.get('hash_algo', 'md5'))
         if existing.get('image_hash') != current_hash:
             return True
         
+        # Same bytes, stale or missing fingerprint (older records): store it so
+        # the next run takes the stat-only path instead of hashing again
+        existing['file_size'], existing['mtime_ns'] = size, mtime_ns
+        with contextlib.suppress(OSError):  # best effort; the record itself is still valid
+            write_atomic(json_path, orjson.dumps(existing, option=orjson.OPT_INDENT_2 if PRETTY_JSON else 0))
+        
         return False
         
     except Exception:
         return True
 
-def process_single_item(args: tuple) -> Optional[Dict]:
+def save_item(job: FileJob, decoded: DecodedImage, tags_dict: Dict):
+    """Build the WardrobeItem for one tagged image and write its JSON record."""
+    image_path, base_name, json_path = job
+    
+    # Convert to structured metadata
+    category = normalize_category(tags_dict['category'])
+    formality = normalize_formality(tags_dict['formality'])
+    metadata = ClothingMetadata(
+        category=category,
+        sub_category=tags_dict['sub_category'],
+        primary_color=tags_dict['primary_color'],
+        secondary_color=tags_dict.get('secondary_color'),
+        pattern=tags_dict['pattern'],
+        material=tags_dict.get('material'),
+        seasonality=normalize_season(tags_dict['seasonality']),
+        formality=formality,
+        fit=tags_dict.get('fit'),
+        occasion=tags_dict.get('occasion', []),
+        style_tags=tags_dict.get('style_tags', []),
+
+        # 👇 ADD THESE THREE LINES
+        length_profile="Standard",
+        layer_role=infer_layer_role(category, tags_dict['sub_category']),
+        silhouette_volume=map_volume(tags_dict.get('fit')),
+        pairing_bias=pairing_bias(tags_dict['primary_color'], tags_dict['pattern'], formality)
+    )
+    
+    # Hash and fingerprint come from the same read as the pixels
+    image_hash = decoded.hash_hex
+    file_size, mtime_ns = decoded.fingerprint
+    
+    # Create record
+    record = WardrobeItem(
+        id=base_name,
+        timestamp=time.time(),
+        image_hash=image_hash,
+        file_size=file_size,
+        mtime_ns=mtime_ns,
+        meta=metadata,
+        paths={"clean": str(image_path)}
+    )
+    
+    # Save to JSON (compact bytes unless --pretty was requested); no fsync, the
+    # rename alone keeps an interrupted run from leaving a truncated record
+    write_atomic(json_path, orjson.dumps(asdict(record), option=orjson.OPT_INDENT_2 if PRETTY_JSON else 0))
+    
+    logger.debug(f"Processed: {base_name}")
+
+def save_duplicate(job: FileJob, decoded: DecodedImage, source_json: Path):
+    """Write a record for a byte-identical copy of an already tagged image."""
+    with open(source_json, 'rb') as f:
+        record = orjson.loads(f.read())
+    
+    # Same bytes, so same meta and image_hash; only identity and stat differ
+    record['id'] = job.base_name
+    record['timestamp'] = time.time()
+    record['file_size'], record['mtime_ns'] = decoded.fingerprint
+    record['paths'] = {"clean": str(job.abs_path)}
+    write_atomic(job.json_path, orjson.dumps(record, option=orjson.OPT_INDENT_2 if PRETTY_JSON else 0))
+    
+    logger.debug(f"Processed: {job.base_name} (duplicate of {source_json.stem})")
+
+def process_item_group(args: tuple) -> List[Dict]:
     """
-    Worker function for parallel processing.
-    Returns dict with status info.
+    Worker function for parallel processing. Tags up to TAG_BATCH_SIZE
+    images with one Gemini call, falling back to one call per image.
+    Returns a status dict per job.
     """
-    file_path, skip_existing, embeddings_cache = args
+    jobs, skip_existing, images_cache = args
+    statuses = []
+    pending = []
     
+    for job in jobs:
+        try:
+            # Skip if already processed
+            if skip_existing and job.json_path.exists() and not needs_reprocessing(job.json_path, job.abs_path):
+                statuses.append({"status": "skipped", "id": job.base_name})
+                continue
+            
+            # Reuse the image decoded up front; the embedding thread reads the same cache
+            decoded = images_cache.get(job.base_name)
+            if decoded is None:
+                decoded = load_image(job.abs_path)
+            pending.append((job, decoded))
+        except Exception as e:
+            logger.error(f"Failed {job.abs_path.name}: {e}")
+            statuses.append({"status": "failed", "id": str(job.abs_path), "error": str(e)})
+    
+    # Encode each upload once; the blobs are reused by the per-image fallback
+    blobs = []
+    tags_list = None
     try:
-        # Ensure file_path is a Path object and resolve it
-        if not isinstance(file_path, Path):
-            file_path = Path(file_path)
-        
-        # Get absolute path to avoid doubling
-        image_path = file_path.resolve()
-        
-        # Create output path
-        base_name = image_path.stem.replace("_clean", "")
-        json_path = JSON_OUTPUT_DIR / f"{base_name}.json"
-        
-        # Skip if already processed
-        if skip_existing and json_path.exists() and not needs_reprocessing(json_path, image_path):
-            return {"status": "skipped", "id": base_name}
-        
-        # Load image
-        pil_img = Image.open(image_path).convert('RGB')
-        
-        # Get AI tags with retry logic
-        tags_dict = get_tags_with_retry(pil_img)
-        
-        # Convert to structured metadata
-        metadata = ClothingMetadata(
-    category=normalize_category(tags_dict['category']),
-    sub_category=tags_dict['sub_category'],
-    primary_color=tags_dict['primary_color'],
-    secondary_color=tags_dict.get('secondary_color'),
-    pattern=tags_dict['pattern'],
-    material=tags_dict.get('material'),
-    seasonality=normalize_season(tags_dict['seasonality']),
-    formality=normalize_formality(tags_dict['formality']),
-    fit=tags_dict.get('fit'),
-    occasion=tags_dict.get('occasion', []),
-    style_tags=tags_dict.get('style_tags', []),
-
-    # 👇 ADD THESE THREE LINES
-    length_profile="Standard",
-    layer_role=infer_layer_role(
-        normalize_category(tags_dict['category']),
-        tags_dict['sub_category']
-    ),
-    silhouette_volume=map_volume(tags_dict.get('fit')),
-    pairing_bias=pairing_bias({
-        "primary_color": tags_dict['primary_color'],
-        "pattern": tags_dict['pattern'],
-        "formality": normalize_formality(tags_dict['formality'])
-    })
-)
-
-        
-        # Get embedding from cache or compute
-        if base_name in embeddings_cache:
-            embedding = embeddings_cache[base_name]
-        else:
-            # Fallback to individual computation
-            embedding = fclip.encode_images([str(image_path)], batch_size=1)[0].tolist()
-        
-        # Get image hash
-        image_hash = get_image_hash(image_path)
-        
-        # Create record
-        record = WardrobeItem(
-            id=base_name,
-            timestamp=time.time(),
-            image_hash=image_hash,
-            meta=metadata,
-            embedding=embedding,
-            paths={"clean": str(image_path)}
-        )
-        
-        # Save to JSON
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(asdict(record), f, indent=2)
-        
-        logger.debug(f"Processed: {base_name}")
-        return {"status": "success", "id": base_name}
-        
+        blobs = [prepare_for_gemini(decoded.pil_rgb) for _, decoded in pending]
+        if len(blobs) > 1:
+            tags_list = get_tags_batch_with_retry(blobs)
     except Exception as e:
-        logger.error(f"Failed {file_path.name if hasattr(file_path, 'name') else file_path}: {e}")
-        return {"status": "failed", "id": str(file_path), "error": str(e)}
+        logger.warning(f"Batch tagging failed, tagging {len(pending)} images one by one: {e}")
+    
+    for i, (job, decoded) in enumerate(pending):
+        try:
+            if tags_list is not None:
+                tags_dict = tags_list[i]
+            else:
+                tags_dict = get_tags_with_retry(blobs[i] if blobs else decoded.pil_rgb)
+            save_item(job, decoded, tags_dict)
+            statuses.append({"status": "success", "id": job.base_name})
+        except Exception as e:
+            logger.error(f"Failed {job.abs_path.name}: {e}")
+            statuses.append({"status": "failed", "id": str(job.abs_path), "error": str(e)})
+    
+    return statuses
 
-def batch_process_embeddings(files_to_process: List[Path]) -> Dict[str, List[float]]:
-    """Pre-compute all embeddings in optimized batches."""
-    logger.info(f"Computing embeddings for {len(files_to_process)} images in batches...")
+def batch_process_embeddings(jobs: List[FileJob], images_cache: Dict[str, DecodedImage]) -> Dict[str, np.ndarray]:
+    """Pre-compute all embeddings with a single batched FashionCLIP pass."""
+    logger.info(f"Computing embeddings for {len(jobs)} images in batches...")
     
     embeddings_map = {}
+    # Unreadable files were left out of the cache; their worker reports the failure
+    jobs = [job for job in jobs if job.base_name in images_cache]
+    images = [images_cache[job.base_name].pil_rgb for job in jobs]
     
-    # Process in batches
-    for i in range(0, len(files_to_process), BATCH_SIZE):
-        batch = files_to_process[i:i + BATCH_SIZE]
+    # One encode_images call over every file; FashionCLIP splits it into
+    # BATCH_SIZE chunks internally, so the model stays saturated.
+    try:
+        all_embeddings = process_image_batch(images)
         
-        try:
-            batch_embeddings = process_image_batch(batch)
+        for job, embedding in zip(jobs, all_embeddings):
+            embeddings_map[job.base_name] = embedding
             
-            for path, embedding in zip(batch, batch_embeddings):
-                base_name = path.stem.replace("_clean", "")
-                embeddings_map[base_name] = embedding
-            
-            logger.debug(f"Processed batch {i//BATCH_SIZE + 1}/{(len(files_to_process)-1)//BATCH_SIZE + 1}")
-                
-        except Exception as e:
-            logger.error(f"Batch processing failed: {e}")
-            # Fallback to individual processing
-            for path in batch:
-                try:
-                    abs_path = path.resolve()
-                    emb = fclip.encode_images([str(abs_path)], batch_size=1)[0].tolist()
-                    base_name = path.stem.replace("_clean", "")
-                    embeddings_map[base_name] = emb
-                except Exception as e2:
-                    logger.error(f"Failed individual embedding for {path.name}: {e2}")
+    except Exception as e:
+        logger.error(f"Batch processing failed: {e}")
+        # Fallback to individual processing
+        for job, image in zip(jobs, images):
+            try:
+                with fclip_inference_context():
+                    emb = fclip.encode_images([image], batch_size=1)[0].astype(np.float16)
+                embeddings_map[job.base_name] = emb
+            except Exception as e2:
+                logger.error(f"Failed individual embedding for {job.abs_path.name}: {e2}")
     
     return embeddings_map
 
+def write_atomic(path: Path, data: bytes):
+    """Write to a sibling .tmp file, then swap it in so readers never see a partial file."""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def save_embeddings(json_dir: Path, embeddings: Dict[str, np.ndarray]):
+    """Write all embeddings as one float16 matrix plus an {id: row} index."""
+    ids = sorted(embeddings)
+    matrix = np.stack([np.asarray(embeddings[i], dtype=np.float16) for i in ids])
+    buf = io.BytesIO()
+    np.save(buf, matrix)
+    write_atomic(json_dir / EMBEDDINGS_FILE, buf.getvalue())
+    write_atomic(json_dir / EMBEDDINGS_INDEX_FILE, orjson.dumps({item_id: row for row, item_id in enumerate(ids)}))
+
+embedding_state = {"vectors": {}, "dirty": False}  # Sidecar contents for this run; dirty = rows not on disk yet
+embedding_lock = Lock()
+
+def flush_embeddings():
+    """Write the sidecar if it has rows that aren't on disk yet."""
+    with embedding_lock:
+        if embedding_state["dirty"] and embedding_state["vectors"]:
+            save_embeddings(JSON_OUTPUT_DIR, embedding_state["vectors"])
+        embedding_state["dirty"] = False
+
+def add_embeddings(embeddings: Dict[str, np.ndarray]):
+    """Merge new rows into the sidecar and write it straight away."""
+    if not embeddings:
+        return
+    with embedding_lock:
+        embedding_state["vectors"].update(embeddings)
+        embedding_state["dirty"] = True
+    flush_embeddings()
+
+CATEGORY_MAP = {
+    "Dress": "One-Piece",
+    "Suit": "One-Piece",
+    "Top": "Top",
+    "Bottom": "Bottom",
+    "Footwear": "Footwear",
+    "Outerwear": "Outerwear",
+    "Accessory": "Accessory"
+}
+SMART_CASUAL_TYPES = frozenset({"Business Casual", "Smart Casual"})
+LOUNGE_TYPES = frozenset({"Athletic", "Lounge"})
+WIDE_FITS = frozenset({"Oversized", "Relaxed", "Loose"})
+NARROW_FITS = frozenset({"Slim", "Skinny"})
+NEUTRAL_COLORS = frozenset({"Black", "White", "Navy", "Grey"})
+
+progress_state = {}  # Counters for the current run; flushed to _progress.json once
+
+def save_progress():
+    """Write unsaved embeddings and the run's counters to _progress.json (atexit / SIGTERM)."""
+    flush_embeddings()
+    if not progress_state:
+        return
+    with open(JSON_OUTPUT_DIR / "_progress.json", 'wb') as f:
+        f.write(orjson.dumps({**progress_state, 'timestamp': time.time()}, option=orjson.OPT_INDENT_2))
+    progress_state.clear()
+
+def _handle_sigterm(signum, frame):
+    # atexit hooks don't run on SIGTERM; flush, then die with the default action
+    save_progress()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
 def normalize_category(raw: str) -> str:
-    mapping = {
-        "Dress": "One-Piece",
-        "Suit": "One-Piece",
-        "Top": "Top",
-        "Bottom": "Bottom",
-        "Footwear": "Footwear",
-        "Outerwear": "Outerwear",
-        "Accessory": "Accessory"
-    }
-    return mapping.get(raw, "Top")  # Safe fallback
+    return CATEGORY_MAP.get(raw, "Top")  # Safe fallback
 
 def normalize_formality(raw: str) -> str:
-    if raw in ["Business Casual", "Smart Casual"]:
+    if raw in SMART_CASUAL_TYPES:
         return "Smart Casual"
-    if raw in ["Athletic", "Lounge"]:
+    if raw in LOUNGE_TYPES:
         return "Lounge"
     return raw
 
@@ -392,30 +735,34 @@ def normalize_season(raw: str) -> List[str]:
         return ["Summer", "Spring", "Fall", "Winter"]
     return [raw]
 
+MID_LAYER_TYPES = ("hoodie", "sweater", "cardigan")
+
+@lru_cache(maxsize=256)
 def infer_layer_role(category, sub_category):
-    sc = sub_category.lower()
     if category == "Outerwear":
         return "Outer"
-    if any(x in sc for x in ["hoodie", "sweater", "cardigan"]):
+    # Substring match: sub_category is free text ("Sweaters", "Hoodie/Sweatshirt")
+    sc = sub_category.lower()
+    if any(t in sc for t in MID_LAYER_TYPES):
         return "Mid"
     if category == "Top":
         return "Base"
     return "None"
 
 def map_volume(fit):
-    if fit in ["Oversized", "Relaxed", "Loose"]:
+    if fit in WIDE_FITS:
         return "Wide"
-    if fit in ["Slim", "Skinny"]:
+    if fit in NARROW_FITS:
         return "Narrow"
     return "Regular"
 
-def pairing_bias(meta):
+def pairing_bias(primary_color, pattern, formality):
     score = 0.0
-    if meta['primary_color'] in ["Black", "White", "Navy", "Grey"]:
+    if primary_color in NEUTRAL_COLORS:
         score += 0.2
-    if meta.get('pattern') == "Solid":
+    if pattern == "Solid":
         score += 0.2
-    if meta.get('formality') == "Formal":
+    if formality == "Formal":
         score -= 0.1  # Less flexible
     return score
 
@@ -430,44 +777,39 @@ def generate_wardrobe_summary(json_dir: Path) -> Dict:
     if not json_files:
         return {}
     
-    categories = {}
-    colors = {}
-    patterns = {}
-    formality = {}
+    categories = Counter()
+    colors = Counter()
+    patterns = Counter()
+    formality = Counter()
     
     for json_file in json_files:
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                item = json.load(f)
+            with open(json_file, 'rb') as f:
+                item = orjson.loads(f.read())
             
             meta = item.get('meta', {})
             
-            cat = meta.get('category', 'Unknown')
-            categories[cat] = categories.get(cat, 0) + 1
-            
-            color = meta.get('primary_color', 'Unknown')
-            colors[color] = colors.get(color, 0) + 1
-            
-            pattern = meta.get('pattern', 'Unknown')
-            patterns[pattern] = patterns.get(pattern, 0) + 1
-            
-            form = meta.get('formality', 'Unknown')
-            formality[form] = formality.get(form, 0) + 1
+            categories[meta.get('category', 'Unknown')] += 1
+            colors[meta.get('primary_color', 'Unknown')] += 1
+            patterns[meta.get('pattern', 'Unknown')] += 1
+            formality[meta.get('formality', 'Unknown')] += 1
             
         except Exception as e:
             logger.error(f"Error reading {json_file.name}: {e}")
     
     return {
         "total_items": len(json_files),
-        "categories": dict(sorted(categories.items(), key=lambda x: x[1], reverse=True)),
-        "colors": dict(sorted(colors.items(), key=lambda x: x[1], reverse=True)),
-        "patterns": dict(sorted(patterns.items(), key=lambda x: x[1], reverse=True)),
-        "formality": dict(sorted(formality.items(), key=lambda x: x[1], reverse=True))
+        "categories": dict(categories.most_common()),
+        "colors": dict(colors.most_common()),
+        "patterns": dict(patterns.most_common()),
+        "formality": dict(formality.most_common())
     }
 
-def main(force_reprocess: bool = False):
+def main(force_reprocess: bool = False, pretty: bool = False):
     """Main processing pipeline with optimized batching and parallel processing."""
-    global model, fclip, last_api_call_time
+    global model, fclip, embedded_ids, PRETTY_JSON
+    
+    PRETTY_JSON = pretty
     
     # Initialize
     JSON_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -476,85 +818,162 @@ def main(force_reprocess: bool = False):
     fclip = init_fashion_clip()
     
     # Reset rate limiter
-    last_api_call_time = 0
+    rate_limiter.reset()
     
-    # Discover files - use resolve() to get absolute paths
+    # Copy existing sidecar rows out of the memmap so the file can be rewritten
+    embedding_state["vectors"] = {k: np.array(v, dtype=np.float16) for k, v in load_embeddings(str(JSON_OUTPUT_DIR)).items()}
+    embedding_state["dirty"] = False
+    embedded_ids = set(embedding_state["vectors"])
+    
+    # Discover files; resolving the directory once makes every child path absolute
     valid_exts = {'.png', '.webp'}
-    all_files = [
-        f.resolve() for f in CLEAN_IMAGES_DIR.iterdir()
+    clean_images_root = CLEAN_IMAGES_DIR.resolve()
+    all_jobs = [
+        make_job(f) for f in clean_images_root.iterdir()
         if f.suffix.lower() in valid_exts and f.is_file()
     ]
     
-    if not all_files:
-        logger.error(f"No images found in {CLEAN_IMAGES_DIR.resolve()}")
+    if not all_jobs:
+        logger.error(f"No images found in {clean_images_root}")
         return
     
-    logger.info(f"Found {len(all_files)} images")
+    logger.info(f"Found {len(all_jobs)} images")
     
-    # Filter files that need processing
-    files_to_process = []
-    for f in all_files:
-        base_name = f.stem.replace("_clean", "")
-        json_path = JSON_OUTPUT_DIR / f"{base_name}.json"
-        
-        if force_reprocess or needs_reprocessing(json_path, f):
-            files_to_process.append(f)
+    # Filter files that need processing. Reading JSON and hashing images is
+    # I/O-bound (hashing releases the GIL), so check files in parallel.
+    def check(job: FileJob) -> bool:
+        return force_reprocess or needs_reprocessing(job.json_path, job.abs_path)
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        jobs_to_process = [job for job, stale in zip(all_jobs, executor.map(check, all_jobs)) if stale]
     
-    logger.info(f"Processing {len(files_to_process)} items (skipping {len(all_files) - len(files_to_process)} existing)")
+    logger.info(f"Processing {len(jobs_to_process)} items (skipping {len(all_jobs) - len(jobs_to_process)} existing)")
     
-    if not files_to_process:
+    if not jobs_to_process:
         logger.info("All items already processed!")
         summary = generate_wardrobe_summary(JSON_OUTPUT_DIR)
-        logger.info(f"\nWardrobe Summary:\n{json.dumps(summary, indent=2)}")
+        logger.info(f"\nWardrobe Summary:\n{orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode()}")
         return
     
     # Estimate processing time for free tier
-    estimated_minutes = (len(files_to_process) * RATE_LIMIT_DELAY) / 60
+    estimated_minutes = len(jobs_to_process) / (REQUESTS_PER_MINUTE * TAG_BATCH_SIZE)
     logger.info(f"Estimated processing time: {estimated_minutes:.1f} minutes ({GEMINI_MODEL} @ {REQUESTS_PER_MINUTE} RPM)")
     
-    # Pre-compute embeddings in batches
-    embeddings_cache = batch_process_embeddings(files_to_process)
+    # Read and decode each image once; the embedding pass and the Gemini workers share it.
+    # File reads, hashing and PIL decoding release the GIL, so load in parallel.
+    def try_load(job: FileJob) -> Optional[DecodedImage]:
+        try:
+            return load_image(job.abs_path)
+        except Exception as e:
+            logger.error(f"Failed to read {job.abs_path.name}: {e}")
+            return None
+    
+    images_cache = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        for job, decoded in zip(jobs_to_process, executor.map(try_load, jobs_to_process)):
+            if decoded is not None:
+                images_cache[job.base_name] = decoded
+    
+    # Byte-identical images (re-exports, copies) share one Gemini call and one embedding
+    unique_jobs = []
+    duplicates = []  # (job, job whose tags/embedding it reuses)
+    first_by_hash = {}
+    for job in jobs_to_process:
+        decoded = images_cache.get(job.base_name)
+        first = first_by_hash.setdefault(decoded.hash_hex, job) if decoded is not None else job
+        if first is job:
+            unique_jobs.append(job)
+        else:
+            duplicates.append((job, first))
+    if duplicates:
+        logger.info(f"Reusing tags for {len(duplicates)} duplicate images")
     
     # Process tags in parallel (but rate-limited)
     logger.info("Generating AI tags with rate limiting...")
-    logger.info(f"Using {MAX_WORKERS} workers with {RATE_LIMIT_DELAY}s delay between API calls")
+    logger.info(f"Using {MAX_WORKERS}-{MAX_CONCURRENCY} adaptive workers, at most {REQUESTS_PER_MINUTE} API calls per {RATE_LIMIT_WINDOW:.0f}s")
     
     results = {"success": [], "failed": [], "skipped": []}
     start_time = time.time()
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        args = [(f, not force_reprocess, embeddings_cache) for f in files_to_process]
+    # FashionCLIP runs on its own thread so the GPU works while the Gemini
+    # workers wait on the API; wall clock is max(embed, tag) instead of the sum.
+    embed_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    embed_future = embed_executor.submit(batch_process_embeddings, unique_jobs, images_cache)
+    
+    def persist_embeddings(future):
+        # Save as soon as FashionCLIP is done, so a run interrupted while
+        # tagging doesn't lose them and re-send those items to Gemini
+        if future.exception() is None:
+            add_embeddings(future.result())
+    embed_future.add_done_callback(persist_embeddings)
+    
+    # Pool is sized for the AIMD ceiling; gemini_concurrency gates the actual calls
+    progress_state.update(completed=0, total=len(unique_jobs), success=0, failed=0)
+    atexit.register(save_progress)
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        args = [
+            (unique_jobs[i:i + TAG_BATCH_SIZE], not force_reprocess, images_cache)
+            for i in range(0, len(unique_jobs), TAG_BATCH_SIZE)
+        ]
         
-        with tqdm(total=len(files_to_process), desc="Processing", unit="item") as pbar:
-            futures = {executor.submit(process_single_item, arg): arg for arg in args}
+        with tqdm(total=len(unique_jobs), desc="Processing", unit="item") as pbar:
+            futures = {executor.submit(process_item_group, arg): arg for arg in args}
             
             completed = 0
             for future in concurrent.futures.as_completed(futures):
-                result = future.result()
-                if result:
+                group_results = future.result()
+                for result in group_results:
                     status = result.get("status", "failed")
                     results[status].append(result.get("id", "unknown"))
                 
-                completed += 1
+                completed += len(group_results)
                 
                 # Update progress bar with current stats
                 pbar.set_postfix({
                     'success': len(results['success']),
                     'failed': len(results['failed'])
                 })
-                pbar.update(1)
+                pbar.update(len(group_results))
                 
-                # Save progress every 5 items
-                if completed % 5 == 0:
-                    progress_file = JSON_OUTPUT_DIR / "_progress.json"
-                    with open(progress_file, 'w', encoding='utf-8') as f:
-                        json.dump({
-                            'completed': completed,
-                            'total': len(files_to_process),
-                            'success': len(results['success']),
-                            'failed': len(results['failed']),
-                            'timestamp': time.time()
-                        }, f, indent=2)
+                # Counters only; save_progress writes them at exit or on SIGTERM
+                progress_state.update(
+                    completed=completed,
+                    success=len(results['success']),
+                    failed=len(results['failed'])
+                )
+    
+    # Unique items' embeddings were saved by persist_embeddings when the thread finished
+    embeddings_cache = embed_future.result()
+    embed_executor.shutdown()
+    
+    # Duplicates copy the record and embedding of the image they matched
+    succeeded = set(results['success']) | set(results['skipped'])
+    for job, first in duplicates:
+        if first.base_name not in succeeded:
+            results['failed'].append(str(job.abs_path))
+            continue
+        try:
+            save_duplicate(job, images_cache[job.base_name], first.json_path)
+            results['success'].append(job.base_name)
+            if first.base_name in embeddings_cache:
+                embeddings_cache[job.base_name] = embeddings_cache[first.base_name]
+        except Exception as e:
+            logger.error(f"Failed {job.abs_path.name}: {e}")
+            results['failed'].append(str(job.abs_path))
+    images_cache.clear()
+    
+    missing = [item_id for item_id in results['success'] if item_id not in embeddings_cache]
+    if missing:
+        # needs_reprocessing flags records without an embedding, so these rerun next time
+        logger.warning(f"No embedding for {len(missing)} tagged items, will retry next run: {missing}")
+    
+    # Duplicates' rows are only known now
+    add_embeddings({
+        job.base_name: embeddings_cache[job.base_name]
+        for job, _ in duplicates if job.base_name in embeddings_cache
+    })
     
     # Generate summary
     elapsed_time = time.time() - start_time
@@ -565,17 +984,20 @@ def main(force_reprocess: bool = False):
         logger.warning("Failed items can be retried by running the script again")
     
     summary = generate_wardrobe_summary(JSON_OUTPUT_DIR)
-    logger.info(f"\nWardrobe Summary:\n{json.dumps(summary, indent=2)}")
+    logger.info(f"\nWardrobe Summary:\n{orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode()}")
     
     # Save summary
-    with open(JSON_OUTPUT_DIR / "_wardrobe_summary.json", 'w', encoding='utf-8') as f:
-        json.dump(summary, f, indent=2)
+    with open(JSON_OUTPUT_DIR / "_wardrobe_summary.json", 'wb') as f:
+        f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
     
-    # Clean up progress file
+    # Clean up progress file; drop the counters first so the atexit hook doesn't rewrite it
+    progress_state.clear()
+    atexit.unregister(save_progress)
     progress_file = JSON_OUTPUT_DIR / "_progress.json"
     if progress_file.exists():
         progress_file.unlink()
 
 if __name__ == "__main__":
     force = "--force" in sys.argv
-    main(force_reprocess=force)
\ No newline at end of file
+    pretty = "--pretty" in sys.argv
+    main(force_reprocess=force, pretty=pretty)
\ No newline at end of file
@@ -0,0 +1,9 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def get_fashion_clip():
+    """Process-wide FashionCLIP instance, loaded on first use."""
+    from fashion_clip.fashion_clip import FashionCLIP
+
+    return FashionCLIP('fashion-clip')
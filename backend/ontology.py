@@ -97,3 +97,13 @@ OUTFIT_TEMPLATES: Dict[str, Dict] = {
         ]
     }
 }
+
+
+# Slots flattened once at import: (category value, required, min, max)
+COMPILED_TEMPLATES: Dict[str, tuple] = {
+    name: tuple(
+        (slot["category"].value, slot.get("required", True), slot["min"], slot["max"])
+        for slot in template["slots"]
+    )
+    for name, template in OUTFIT_TEMPLATES.items()
+}
@@ -1,22 +1,48 @@
+import heapq
 import requests
-import json
+import orjson
 import os
+import re
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
-from typing import List, Dict
+from typing import List, Dict, Optional
+from functools import lru_cache
 from fashion_clip.fashion_clip import FashionCLIP
 from store import WardrobeStore
-from ontology import OUTFIT_TEMPLATES, Category
+from models import get_fashion_clip
+from ontology import COMPILED_TEMPLATES, Category
 
 DEBUG_REASONING = True
 
+@lru_cache(maxsize=512)
+def encode_query(text: str) -> np.ndarray:
+    """FashionCLIP text embedding, cached per string (returned read-only)."""
+    vec = get_fashion_clip().encode_text([text], batch_size=1)[0]
+    vec.setflags(write=False)
+    return vec
+
+@lru_cache(maxsize=4)
+def encode_texts(texts: tuple) -> np.ndarray:
+    """Batched FashionCLIP text embeddings, cached per tuple of strings (returned read-only)."""
+    vecs = get_fashion_clip().encode_text(list(texts), batch_size=len(texts))
+    vecs.setflags(write=False)
+    return vecs
+
 COLOR_GROUPS = {
     "neutral": {"black", "white", "grey", "gray", "navy", "beige", "cream", "tan", "brown"},
     "warm": {"red", "orange", "yellow", "maroon", "pink"},
     "cool": {"blue", "green", "olive", "purple"}
 }
 
+# Reverse lookup so grouping a color is one dict probe
+COLOR_TO_GROUP = {
+    color: group
+    for group, values in COLOR_GROUPS.items()
+    for color in values
+}
+
 CONFIDENCE_THRESHOLDS = {
     "minimum": 0.55,
     "good": 0.70,
@@ -40,17 +66,18 @@ def formality_score(outfit: dict) -> float:
     ]
     return 1.0 if len(set(formalities)) == 1 else 0.5
 
-def visual_harmony(outfit: dict, vectors: dict) -> float:
-    vecs = [vectors[item['id']] for item in outfit.values()]
-    if len(vecs) <= 1:
+def visual_harmony(outfit: dict, vectors: dict, unit_vectors: dict) -> float:
+    ids = [item['id'] for item in outfit.values()]
+    if len(ids) <= 1:
         return 1.0
 
-    centroid = np.mean(vecs, axis=0)
-    sims = []
+    centroid = np.mean([vectors[i] for i in ids], axis=0, dtype=np.float32)
+    c_norm = np.sqrt(np.vdot(centroid, centroid))
+    if not c_norm:
+        return 0.0
 
-    for v in vecs:
-        sim = np.dot(v, centroid) / (np.linalg.norm(v) * np.linalg.norm(centroid))
-        sims.append(sim)
+    # Item vectors are pre-normalized, so each cosine is one dot product
+    sims = [np.dot(unit_vectors[i], centroid) / c_norm for i in ids]
 
     return float(np.clip(np.mean(sims), 0.0, 1.0))
 
@@ -90,20 +117,30 @@ class Visualizer:
 
 # --- 2. LIVE WEATHER ---
 class LiveWeather:
+    CACHE_TTL = 300  # seconds; location and current weather barely move between queries
+    _session = requests.Session()  # keeps the HTTP connections alive across calls
+    _cache = {"ts": 0.0, "data": None}
+
     @staticmethod
     def get_weather():
+        cache = LiveWeather._cache
+        if cache["data"] and time.monotonic() - cache["ts"] < LiveWeather.CACHE_TTL:
+            return dict(cache["data"])  # callers may overwrite 'condition'
         try:
-            loc = requests.get("http://ip-api.com/json/", timeout=2).json()
+            session = LiveWeather._session
+            loc = session.get("http://ip-api.com/json/", timeout=2).json()
             lat, lon = loc['lat'], loc['lon']
             url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
-            w = requests.get(url, timeout=2).json()
+            w = session.get(url, timeout=2).json()
             code = w['current_weather']['weathercode']
             temp = w['current_weather']['temperature']
             cond = "Clear"
             if code in [1, 2, 3]: cond = "Cloudy"
             elif code in [61, 63, 65, 80, 81, 82]: cond = "Rainy"
             elif code in [71, 73, 75, 85, 86]: cond = "Snowy"
-            return {"condition": cond, "temp": temp, "city": loc['city']}
+            data = {"condition": cond, "temp": temp, "city": loc['city']}
+            cache["ts"], cache["data"] = time.monotonic(), data
+            return dict(data)
         except:
             return {"condition": "Clear", "temp": 25, "city": "Offline"}
 
@@ -117,8 +154,8 @@ class ShoppingEngine:
         # Load Essentials
         path = os.path.join(data_dir, "essentials.json")
         if os.path.exists(path):
-            with open(path, 'r') as f:
-                self.essentials = json.load(f)
+            with open(path, 'rb') as f:
+                self.essentials = orjson.loads(f.read())
                 print(f"🛍️  Virtual Store loaded: {len(self.essentials)} items")
                 
             # Pre-compute vectors for virtual items using TEXT description
@@ -134,7 +171,16 @@ class ShoppingEngine:
                 ).strip()
                 descriptions.append(desc)
 
-            self.vectors = self.fclip.encode_text(descriptions, batch_size=len(descriptions))
+            # Cached: a new planner per request re-encodes the same catalog otherwise
+            self.vectors = encode_texts(tuple(descriptions))
+
+            # Columns used by find_upgrade's filters, extracted once
+            by_category = {}
+            for idx, i in enumerate(self.essentials):
+                by_category.setdefault(i['meta']['category'], []).append(idx)
+            self.by_category = {cat: np.array(idxs) for cat, idxs in by_category.items()}
+            self.subs = [i['meta']['sub_category'].lower() for i in self.essentials]
+            self.cols = [i['meta']['primary_color'].lower() for i in self.essentials]
         else:
             print("⚠️ essentials.json not found. Shopping engine disabled.")
 
@@ -144,32 +190,36 @@ class ShoppingEngine:
         best_upgrade = None
         max_improvement = 0.0
         
+        # Relevance of every essential to the query in one matmul
+        relevance = self.vectors @ query_vec
+        
         for slot, current_item in current_outfit.items():
-            current_cat = current_item['meta']['category']
+            # 1. Category Match
+            idxs = self.by_category.get(current_item['meta']['category'])
+            if idxs is None: continue
             current_sub = current_item['meta']['sub_category'].lower()
             current_col = current_item['meta']['primary_color'].lower()
             
-            for idx, v_item in enumerate(self.essentials):
-                # 1. Category Match
-                if v_item['meta']['category'] != current_cat: continue
+            # 3. Score Improvement Check, best first (ties in catalog order)
+            improvements = relevance[idxs] - 0.1 # Bias for "Real" items
+            for k in np.argsort(-improvements, kind="stable"):
+                improvement = improvements[k]
+                if improvement <= max_improvement or improvement <= 0.4: break
+                idx = idxs[k]
                 
                 # 2. Redundancy Check (Don't recommend what user already wears)
-                v_sub = v_item['meta']['sub_category'].lower()
-                v_col = v_item['meta']['primary_color'].lower()
+                v_sub = self.subs[idx]
+                v_col = self.cols[idx]
                 
                 # Loose matching to catch things like "Blue Jeans" vs "Navy Jeans"
                 if (current_col in v_col or v_col in current_col) and \
                    (current_sub in v_sub or v_sub in current_sub):
                     continue 
 
-                # 3. Score Improvement Check
-                v_vec = self.vectors[idx]
-                relevance = np.dot(query_vec, v_vec)
-                improvement = relevance - 0.1 # Bias for "Real" items
-                
-                if improvement > max_improvement and improvement > 0.4:
-                    max_improvement = improvement
-                    best_upgrade = f"Buy {v_item['meta']['sub_category']} (Increases match score)"
+                # First non-redundant essential is this slot's best
+                max_improvement = improvement
+                best_upgrade = f"Buy {self.essentials[idx]['meta']['sub_category']} (Increases match score)"
+                break
         
         return best_upgrade
 # --- 4. LOGIC ENGINES ---
@@ -233,18 +283,27 @@ class AccessoryEngine:
 
 class WeatherEngine:
     SENSITIVE = ["suede", "silk", "satin", "velvet", "canvas", "mesh"]
+    # One compiled alternation scans the name once instead of once per keyword
+    SENSITIVE_RE = re.compile("|".join(map(re.escape, SENSITIVE)))
     @staticmethod
-    def is_safe(item: dict, cond: str) -> bool:
-        if "rain" not in cond.lower() and "snow" not in cond.lower(): return True
+    def is_precipitating(cond: str) -> bool:
+        c = cond.lower()
+        return "rain" in c or "snow" in c
+
+    @staticmethod
+    def is_safe(item: dict, cond: str, precipitating: Optional[bool] = None) -> bool:
+        # Callers checking many items pass the precomputed flag for the same weather
+        if precipitating is None: precipitating = WeatherEngine.is_precipitating(cond)
+        if not precipitating: return True
         meta = item['meta']
         name = meta.get('sub_category', '').lower()
-        if any(x in name for x in WeatherEngine.SENSITIVE): return False
+        if WeatherEngine.SENSITIVE_RE.search(name): return False
         if "footwear" in meta.get('category', '').lower() and "white" in meta.get('primary_color', '').lower(): return False
         return True
 
 class ContextBrain:
     @staticmethod
-    def detect_template(query: str, weather: dict, fclip: FashionCLIP) -> str:
+    def detect_template(query: str, weather: dict) -> str:
         q_low = query.lower()
         cond = weather['condition'].lower()
         temp = weather['temp']
@@ -255,25 +314,32 @@ class ContextBrain:
         # if any(t in q_low for t in triggers): return "layered"
         
         # Semantic Check
-        vecs = fclip.encode_text([query, "cold winter layered outfit", "warm summer outfit"], batch_size=3)
-        if np.dot(vecs[0], vecs[1]) > np.dot(vecs[0], vecs[2]): return "layered"
+        q_vec = encode_query(query)
+        if np.dot(q_vec, encode_query("cold winter layered outfit")) > np.dot(q_vec, encode_query("warm summer outfit")): return "layered"
         
         return "basic"
 
 class NeuroSymbolicEngine:
+    # Upper bound on evaluate_pair: 0.5 base + 0.4 * cosine (<= 1) + 0.3 best accessory
+    # bonus; formality only subtracts. Small headroom for float rounding in the cosine.
+    MAX_PAIR_SCORE = 1.2 + 1e-6
+    
+    # Formality clash penalties by ordered pair; any other mismatch costs 0.1, a match nothing
+    FORMALITY_PENALTY = {("Formal", "Lounge"): -0.4, ("Lounge", "Formal"): -0.4}
+    ACCESSORY_PAIRS = frozenset({("Footwear", "Accessory"), ("Accessory", "Footwear")})
+
     @staticmethod
-    def evaluate_pair(item_a, item_b, vec_a, vec_b):
+    def evaluate_pair(item_a, item_b, similarity: float):
         score = 0.5
         
-        # A. Visual Harmony
-        score += (np.dot(vec_a, vec_b) / (np.linalg.norm(vec_a) * np.linalg.norm(vec_b))) * 0.4
+        # A. Visual Harmony (cosine similarity of the two item vectors)
+        score += similarity * 0.4
         
         # B. Formality Check
         f_a = item_a['meta'].get('formality', 'Casual')
         f_b = item_b['meta'].get('formality', 'Casual')
         if f_a != f_b:
-            if {f_a, f_b} == {"Formal", "Lounge"}: score -= 0.4 
-            else: score -= 0.1
+            score += NeuroSymbolicEngine.FORMALITY_PENALTY.get((f_a, f_b), -0.1)
             
         # C. Category-Specific Logic
         cat_a = item_a['meta'].get('category')
@@ -282,7 +348,7 @@ class NeuroSymbolicEngine:
         # Silhouette is evaluated at outfit-level, not pair-level
             
         # 2. Accessories (Shoes vs Accessory)
-        if {cat_a, cat_b} == {"Footwear", "Accessory"}:
+        if (cat_a, cat_b) in NeuroSymbolicEngine.ACCESSORY_PAIRS:
             shoe = item_a if cat_a == "Footwear" else item_b
             acc = item_b if cat_b == "Accessory" else item_a
             formality = shoe['meta'].get('formality', 'Casual')
@@ -293,41 +359,40 @@ class NeuroSymbolicEngine:
 class ColorHarmonyEngine:
     @staticmethod
     def _group(color: str) -> str:
-        c = color.lower()
-        for group, values in COLOR_GROUPS.items():
-            if c in values:
-                return group
-        return "unknown"
+        return COLOR_TO_GROUP.get(color.lower(), "unknown")
 
     @staticmethod
     def evaluate(outfit: dict) -> float:
-        colors = [
-            item['meta'].get('primary_color', '').lower()
-            for item in outfit.values()
-            if item['meta'].get('primary_color')
-        ]
-
-        if len(colors) <= 1:
+        # Single pass: tally distinct colors and group counts, then apply the rules
+        n_colors = 0
+        distinct = set()
+        counts = {"neutral": 0, "warm": 0, "cool": 0, "unknown": 0}
+        for item in outfit.values():
+            color = item['meta'].get('primary_color')
+            if not color:
+                continue
+            c = color.lower()
+            n_colors += 1
+            distinct.add(c)
+            counts[ColorHarmonyEngine._group(c)] += 1
+
+        if n_colors <= 1:
             return 1.0  # Single-color outfits are safe
 
-        groups = [ColorHarmonyEngine._group(c) for c in colors]
-
         # Rule 1: All same color (monochrome)
-        if len(set(colors)) == 1:
+        if len(distinct) == 1:
             return 1.0
 
         # Rule 2: Neutral dominance
-        neutral_count = groups.count("neutral")
-        if neutral_count >= len(groups) - 1:
+        if counts["neutral"] >= n_colors - 1:
             return 0.9
 
         # Rule 3: Mixed warm & cool without neutral
-        if "warm" in groups and "cool" in groups and "neutral" not in groups:
+        if counts["warm"] and counts["cool"] and not counts["neutral"]:
             return 0.4
 
         # Rule 4: Too many non-neutral colors
-        loud_colors = [g for g in groups if g in {"warm", "cool"}]
-        if len(loud_colors) >= 3:
+        if counts["warm"] + counts["cool"] >= 3:
             return 0.3
 
         return 0.7
@@ -429,7 +494,7 @@ def explain_outfit(outfit: dict):
 
     return reasons
 
-def compute_confidence(outfit: dict, template_name: str, weather: dict, vectors: dict) -> dict:
+def compute_confidence(outfit: dict, template_name: str, weather: dict, vectors: dict, unit_vectors: dict) -> dict:
     breakdown = {}
 
     # 1. Silhouette
@@ -446,27 +511,26 @@ def compute_confidence(outfit: dict, template_name: str, weather: dict, vectors:
     )
 
     # 3. Visual Harmony
-    breakdown["visual"] = visual_harmony(outfit, vectors)
+    breakdown["visual"] = visual_harmony(outfit, vectors, unit_vectors)
 
     # 4. Color Harmony
     breakdown["color"] = ColorHarmonyEngine.evaluate(outfit)
 
-    # 5. Formality
-    breakdown["formality"] = formality_score(outfit)
-
-    # 6. Weather Safety
-    breakdown["weather"] = (
-        1.0 if all(
-            WeatherEngine.is_safe(i, weather['condition'])
-            for i in outfit.values()
-        ) else 0.5
-    )
+    # 5-7. Formality, Weather Safety & Versatility share a single pass over the items
+    precipitating = WeatherEngine.is_precipitating(weather['condition'])
+    formalities = set()
+    all_safe = True
+    bias_total = 0.0
+    for item in outfit.values():
+        meta = item['meta']
+        formalities.add(meta.get('formality', 'Casual'))
+        bias_total += meta.get('pairing_bias', 0.0)
+        if all_safe and not WeatherEngine.is_safe(item, weather['condition'], precipitating):
+            all_safe = False
 
-    # 7. Versatility
-    breakdown["versatility"] = np.mean([
-        item['meta'].get('pairing_bias', 0.0)
-        for item in outfit.values()
-    ])
+    breakdown["formality"] = 1.0 if len(formalities) == 1 else 0.5
+    breakdown["weather"] = 1.0 if all_safe else 0.5
+    breakdown["versatility"] = bias_total / len(outfit) if outfit else 0.0
 
     # Final Weighted Sum
     confidence = sum(
@@ -481,29 +545,41 @@ def compute_confidence(outfit: dict, template_name: str, weather: dict, vectors:
 
 
 # --- 5. MASTER PLANNER V7 ---
+# Query keywords that boost candidates mentioning them; bit i of a mask <=> BOOSTERS[i]
+BOOSTERS = ("leather", "denim", "linen", "boots", "sneakers", "hoodie", "bomber", "belt", "watch")
+
+def keyword_mask(text: str) -> int:
+    return sum(1 << i for i, k in enumerate(BOOSTERS) if k in text)
+
 class ProPlannerV7:
     def __init__(self, store: WardrobeStore):
         self.store = store
         print("🧠 Loading Planner V7 (Shopping & Accessories Enabled)...")
-        self.fclip = FashionCLIP('fashion-clip')
+        self.fclip = get_fashion_clip()  # Shared with json_from_clean; loaded once per process
         self.BEAM_WIDTH = 5
         
         # Init Shopping Brain
         self.shopper = ShoppingEngine(self.fclip, store.data_dir)
+        
+        # item id -> BOOSTERS mask of its description, filled lazily by apply_hybrid_ranking
+        self.boost_masks: Dict[str, int] = {}
 
     def apply_hybrid_ranking(self, candidates: List[dict], query: str) -> List[dict]:
         q = query.lower()
-        boosters = ["leather", "denim", "linen", "boots", "sneakers", "hoodie", "bomber", "belt", "watch"]
-        active_boosts = [k for k in boosters if k in q]
+        q_mask = keyword_mask(q)
         formal_req = "formal" in q or "interview" in q or "wedding" in q
         casual_req = "casual" in q or "chill" in q
         
         for c in candidates:
             meta = c['item']['meta']
-            desc = f"{meta.get('sub_category','')} {meta.get('material','')} {meta.get('category','')}".lower()
             formality = meta.get('formality', 'Casual')
             
-            matches = sum(1 for k in active_boosts if k in desc)
+            item_mask = self.boost_masks.get(c['item']['id'])
+            if item_mask is None:
+                desc = f"{meta.get('sub_category','')} {meta.get('material','')} {meta.get('category','')}".lower()
+                item_mask = self.boost_masks[c['item']['id']] = keyword_mask(desc)
+            
+            matches = bin(item_mask & q_mask).count("1")
             if matches > 0: c['score'] += (matches * 0.5)
             
             if formal_req and formality == "Casual": c['score'] -= 0.5 
@@ -514,36 +590,31 @@ class ProPlannerV7:
     def plan(self, user_query: str, manual_weather: str = None) -> dict:
         weather = LiveWeather.get_weather()
         if manual_weather: weather['condition'] = manual_weather 
+        precipitating = WeatherEngine.is_precipitating(weather['condition'])
         
         print(f"\n🌍 {weather['city']}: {weather['condition']}, {weather['temp']}°C")
         print(f"🚀 Planning for: '{user_query}'")
         
-        template_name = ContextBrain.detect_template(user_query, weather, self.fclip)
-        template = OUTFIT_TEMPLATES.get(template_name, OUTFIT_TEMPLATES["basic"])
-
-        slot_rules = template["slots"]
-        slot_names = [slot["category"].value for slot in slot_rules]
+        template_name = ContextBrain.detect_template(user_query, weather)
+        slot_rules = COMPILED_TEMPLATES.get(template_name, COMPILED_TEMPLATES["basic"])
+        slot_names = [slot[0] for slot in slot_rules]
 
         print("🧩 Template:", template_name)
-        print("🧩 Slots:", [slot["category"].value for slot in slot_rules])
+        print("🧩 Slots:", slot_names)
 
-        q_vec = self.fclip.encode_text([user_query], batch_size=1)[0]
-        candidates_map = {}        
-        # q_vec = self.fclip.encode_text([user_query], batch_size=1)[0]
-        # candidates_map = {}
+        q_vec = encode_query(user_query)
+        candidates_map = {}
         
-        # 1. Retrieval
-        for slot in slot_rules:
-            category = slot["category"]
-            required = slot.get("required", True)
-            slot_name = category.value
-            raw = self.store.vector_search(q_vec, category_filter=slot_name, top_k=20)
+        # 1. Retrieval (one scoring pass for every slot)
+        retrieved = self.store.vector_search_multi(q_vec, slot_names, top_k=20)
+        for slot_name, required, _, _ in slot_rules:
+            raw = retrieved[slot_name]
             ranked = self.apply_hybrid_ranking(raw, user_query)
-            valid = [r for r in ranked if WeatherEngine.is_safe(r['item'], weather['condition'])]
+            valid = [r for r in ranked if WeatherEngine.is_safe(r['item'], weather['condition'], precipitating)]
             
             if not valid:
                 # Accessories might not be in user wardrobe yet, don't fail, just warn
-                if category == Category.ACCESSORY and not required:
+                if slot_name == Category.ACCESSORY.value and not required:
                     print("⚠️ No Accessories found in wardrobe (Skipping slot)")
                     continue
                 else:
@@ -557,51 +628,90 @@ class ProPlannerV7:
 
         # 2. Beam Search
         first_slot = valid_slot_names[0]
-        beam = [[(c['score'], [c['item']]) for c in candidates_map[first_slot]]]
-        beam = sorted(beam[0], reverse=True)[:self.BEAM_WIDTH]
+        beam = heapq.nlargest(
+            self.BEAM_WIDTH,
+            ((c['score'], [c['item']]) for c in candidates_map[first_slot]),
+            key=lambda x: x[0]
+        )
         
+        rows = self.store.id_to_row
+        units = self.store.unit_matrix
+        # (last id, candidate id) -> evaluate_pair, shared by every path ending in the same item
+        pair_compat = {}
         for slot_name in valid_slot_names[1:]:
+            candidates = candidates_map[slot_name]
+            # Every (path tail, candidate) cosine for this slot in one matmul,
+            # one row per distinct tail item since paths often share it
+            last_rows = [rows[items[-1]['id']] for _, items in beam]
+            tail_index = {r: k for k, r in enumerate(dict.fromkeys(last_rows))}
+            cand_units = units[[rows[c['item']['id']] for c in candidates]]
+            sims = units[list(tail_index)] @ cand_units.T
+            cand_formality = [c['item']['meta'].get('formality', 'Casual') for c in candidates]
+            
+            # Min-heap of the best BEAM_WIDTH (new_score, -seq, items); -seq keeps the
+            # earlier path on ties, same as the stable sort it replaces
             next_beam = []
-            for score, items in beam:
+            seq = 0
+            max_pair_part = NeuroSymbolicEngine.MAX_PAIR_SCORE * 0.3
+            # Same bound for a formality-clash pair (e.g. Formal + Lounge)
+            clash_pair_part = (NeuroSymbolicEngine.MAX_PAIR_SCORE
+                               + max(NeuroSymbolicEngine.FORMALITY_PENALTY.values())) * 0.3
+            for i, (score, items) in enumerate(beam):
                 last = items[-1]
-                l_vec = self.store.vectors[last['id']]
+                last_sims = sims[tail_index[last_rows[i]]]
+                last_formality = last['meta'].get('formality', 'Casual')
+                path_part = score * 0.4
                 
-                for c in candidates_map[slot_name]:
+                for j, c in enumerate(candidates):
+                    # Candidates are sorted by score, so once even a perfect pair can't
+                    # beat the current K-th best, no later candidate can either
+                    if len(next_beam) == self.BEAM_WIDTH:
+                        cand_part = path_part + (c['score'] * 0.3)
+                        if cand_part + max_pair_part <= next_beam[0][0]:
+                            break
+                        # A formality clash can't make it either: skip the pair, keep scanning
+                        if (last_formality, cand_formality[j]) in NeuroSymbolicEngine.FORMALITY_PENALTY and \
+                           cand_part + clash_pair_part <= next_beam[0][0]:
+                            continue
                     curr = c['item']
-                    c_vec = self.store.vectors[curr['id']]
                     
-                    compatibility = NeuroSymbolicEngine.evaluate_pair(last, curr, l_vec, c_vec)
+                    key = (last['id'], curr['id'])
+                    compatibility = pair_compat.get(key)
+                    if compatibility is None:
+                        compatibility = pair_compat[key] = NeuroSymbolicEngine.evaluate_pair(last, curr, float(last_sims[j]))
                     # Weighted Score
-                    new_score = (score * 0.4) + (c['score'] * 0.3) + (compatibility * 0.3)
-                    next_beam.append((new_score, items + [curr]))
+                    new_score = path_part + (c['score'] * 0.3) + (compatibility * 0.3)
+                    entry = (new_score, -seq, items + [curr])
+                    seq += 1
+                    if len(next_beam) < self.BEAM_WIDTH:
+                        heapq.heappush(next_beam, entry)
+                    elif entry[:2] > next_beam[0][:2]:
+                        heapq.heapreplace(next_beam, entry)
             
-            beam = sorted(next_beam, key=lambda x: x[0], reverse=True)[:self.BEAM_WIDTH]
+            beam = [(new_score, items) for new_score, _, items in sorted(next_beam, reverse=True)]
 
         if not beam: return {}
         best_score = -1e9
         best_outfit = None
+        best_confidence = None
 
         for score, items in beam:
             outfit = {s: i for s, i in zip(valid_slot_names, items)}
-            rule_bonus = apply_outfit_rules(outfit, template_name)
             confidence = compute_confidence(
-    outfit, template_name, weather, self.store.vectors
-)["score"]
+    outfit, template_name, weather, self.store.vectors, self.store.unit_vectors
+)
 
-            final_score = (score * 0.7) + (confidence * 0.3)
+            final_score = (score * 0.7) + (confidence["score"] * 0.3)
 
             if final_score > best_score:
                 best_score = final_score
                 best_outfit = outfit
+                best_confidence = confidence
 
         outfit = best_outfit
 
-        confidence = compute_confidence(
-    outfit=outfit,
-    template_name=template_name,
-    weather=weather,
-    vectors=self.store.vectors
-)
+        # Reuse the winner's confidence instead of scoring it a second time
+        confidence = best_confidence
 
         confidence_score = confidence["score"]
         if confidence_score < CONFIDENCE_THRESHOLDS["minimum"]:
@@ -619,9 +729,6 @@ class ProPlannerV7:
             print("•", r)
 
 
-        confidence_breakdown = confidence["breakdown"]
-
-
         print(f"🧠 Confidence Score: {confidence_score:.2f}")
 
         print(f"✨ Outfit Found (Score: {best_score:.3f})")
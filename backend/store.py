@@ -1,9 +1,28 @@
 import os
-import json
+import orjson
 import numpy as np
 from typing import List, Dict, Optional
 from ontology import Category
 
+# Shared float16 embedding matrix written by json_from_clean.py, with an
+# {item_id: row} index. Both live next to the per-item JSON files.
+EMBEDDINGS_FILE = "_embeddings.npy"
+EMBEDDINGS_INDEX_FILE = "_embeddings_index.json"
+
+
+def load_embeddings(json_dir: str) -> Dict[str, np.ndarray]:
+    """Memory-maps the embedding matrix and returns {item_id: row view}."""
+    matrix_path = os.path.join(json_dir, EMBEDDINGS_FILE)
+    index_path = os.path.join(json_dir, EMBEDDINGS_INDEX_FILE)
+    if not (os.path.exists(matrix_path) and os.path.exists(index_path)):
+        return {}
+
+    matrix = np.load(matrix_path, mmap_mode="r")
+    with open(index_path, "rb") as f:
+        index = orjson.loads(f.read())
+    return {item_id: matrix[row] for item_id, row in index.items()}
+
+
 class WardrobeStore:
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
@@ -19,30 +38,56 @@ class WardrobeStore:
         
         if not os.path.exists(json_dir):
             print(f"⚠️ No data found in {json_dir}")
+            self.build_index()
             return
 
-        files = [f for f in os.listdir(json_dir) if f.endswith(".json")]
+        # "_" files are summaries / sidecars, not items
+        files = [f for f in os.listdir(json_dir) if f.endswith(".json") and not f.startswith("_")]
         print(f"📂 Loading {len(files)} items into State Memory...")
+        
+        sidecar = load_embeddings(json_dir)
 
         for f in files:
             path = os.path.join(json_dir, f)
             try:
-                with open(path, "r") as file:
-                    data = json.load(file)
+                with open(path, "rb") as file:
+                    data = orjson.loads(file.read())
                     item_id = data.get("id")
                     
                     # 1. Store Metadata
                     self.items[item_id] = data
                     
-                    # 2. Store Vector (if it exists)
+                    # 2. Store Vector (inline in older records, else from the sidecar matrix).
+                    # Kept as float16 like the sidecar; build_index upcasts the search matrix.
                     if "embedding" in data and data["embedding"]:
-                        self.vectors[item_id] = np.array(data["embedding"], dtype=np.float32)
+                        self.vectors[item_id] = np.array(data["embedding"], dtype=np.float16)
+                    elif item_id in sidecar:
+                        self.vectors[item_id] = sidecar[item_id]
                         
             except Exception as e:
                 print(f"❌ Corrupt file {f}: {e}")
         
+        self.build_index()
         print(f"✅ State Loaded: {len(self.items)} physical items, {len(self.vectors)} semantic vectors.")
 
+    def build_index(self):
+        """Stacks self.vectors into one matrix (plus row norms, unit rows and categories) for batched search."""
+        self.vector_ids = list(self.vectors)
+        if self.vector_ids:
+            self.matrix = np.stack([self.vectors[i] for i in self.vector_ids])
+        else:
+            self.matrix = np.empty((0, 0), dtype=np.float16)
+        # Raw vectors stay float16; math runs in float32 (NumPy has no BLAS path for float16)
+        matrix32 = self.matrix.astype(np.float32)
+        self.norms = np.linalg.norm(matrix32, axis=1)
+        # Unit-length rows: item-to-item cosine is a plain dot product
+        self.unit_matrix = matrix32 / np.where(self.norms > 0, self.norms, 1.0)[:, None]
+        self.id_to_row = {item_id: row for row, item_id in enumerate(self.vector_ids)}
+        self.unit_vectors = {item_id: self.unit_matrix[row] for item_id, row in self.id_to_row.items()}
+        self.vector_categories = np.array(
+            [self.items[i]["meta"].get("category") for i in self.vector_ids], dtype=object
+        )
+
     def get_by_category(self, category: Category) -> List[dict]:
         """Filter: Get all Tops, or all Shoes"""
         return [
@@ -54,45 +99,50 @@ class WardrobeStore:
         """
         The 'Magic' Search: Finds items mathematically similar to a query vector.
         """
-        if not self.vectors:
+        if not self.vector_ids:
             return []
 
-        # Convert query to numpy
+        scores = self._query_scores(query_vector)
+        if category_filter:
+            filter_cat = category_filter.value if hasattr(category_filter, "value") else category_filter
+            rows = np.flatnonzero(self.vector_categories == filter_cat)
+        else:
+            rows = np.arange(len(self.vector_ids))
+
+        return self._top_k(scores, rows, top_k)
+
+    def vector_search_multi(self, query_vector: List[float], category_filters: List, top_k: int = 5) -> Dict[str, List[dict]]:
+        """
+        vector_search for several categories at once: one matmul over the
+        whole wardrobe, then a mask + top-k per category.
+        """
+        filters = [c.value if hasattr(c, "value") else c for c in category_filters]
+        if not self.vector_ids:
+            return {c: [] for c in filters}
+
+        scores = self._query_scores(query_vector)
+        return {
+            cat: self._top_k(scores, np.flatnonzero(self.vector_categories == cat), top_k)
+            for cat in filters
+        }
+
+    def _query_scores(self, query_vector) -> np.ndarray:
+        """Cosine of the query against every indexed item, in vector_ids order."""
         query_vec = np.array(query_vector, dtype=np.float32)
-        
-        # Calculate Cosine Similarity against ALL items
-        # (Dot product of normalized vectors)
-        scores = []
-        for item_id, item_vec in self.vectors.items():
-            # Filter by category if requested
-            if category_filter:
-                item_cat = self.items[item_id]["meta"].get("category")
-                filter_cat = (
-                    category_filter.value
-                    if hasattr(category_filter, "value")
-                    else category_filter
-                )
-
-                if item_cat != filter_cat:
-                    continue
-
-
-            # Cosine Similarity Formula: (A . B) / (||A|| * ||B||)
-            similarity = np.dot(query_vec, item_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(item_vec))
-            scores.append((item_id, similarity))
-
-        # Sort by highest score
-        scores.sort(key=lambda x: x[1], reverse=True)
-        
-        # Return top K items
-        results = []
-        for item_id, score in scores[:top_k]:
-            results.append({
-                "item": self.items[item_id],
-                "score": float(score)
-            })
-            
-        return results
+        q_norm = np.linalg.norm(query_vec)
+        return self.unit_matrix @ (query_vec / q_norm if q_norm else query_vec)
+
+    def _top_k(self, scores: np.ndarray, rows: np.ndarray, top_k: int) -> List[dict]:
+        """Best top_k of the given rows, highest first (argpartition, then sort only those)."""
+        if top_k <= 0:
+            return []
+        if len(rows) > top_k:
+            rows = rows[np.argpartition(scores[rows], -top_k)[-top_k:]]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [
+            {"item": self.items[self.vector_ids[r]], "score": float(scores[r])}
+            for r in rows
+        ]
 
 # --- TEST CODE (Run this file directly to test) ---
 if __name__ == "__main__":